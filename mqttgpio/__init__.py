@@ -2,12 +2,140 @@
 
 import json
 import logging
+import re
 
 import gpiozero # type: ignore
 import paho.mqtt.client as mqtt # type: ignore
 
+# command payload -> state, accepts the case variants home assistant sometimes sends
+COMMANDS = {
+    b'ON' : True,
+    b'OFF' : False,
+    b'on' : True,
+    b'off' : False,
+    b'1' : True,
+    b'0' : False,
+}
+
+class FastConfigParser():
+    """ a minimal dict-backed stand-in for configparser.ConfigParser
+
+        only handles flat [Section] / key = value (or key: value) files, which is all
+        the mqttgpio config uses. option names are lower-cased like configparser does,
+        indented lines continue the previous value, and anything else raises ValueError.
+    """
+    _SECTION_RE = re.compile(r'^\[([^\]]+)\]\s*$')
+    _ENTRY_RE = re.compile(r'^([^=:;#\s][^=:]*?)\s*[=:]\s*(.*?)\s*$')
+    _BOOLEAN_STATES = {
+        '1' : True, 'yes' : True, 'true' : True, 'on' : True,
+        '0' : False, 'no' : False, 'false' : False, 'off' : False,
+    }
+    _MISSING = object()
+
+    def __init__(self, filenames: list):
+        self._sections: dict[str, dict[str, str]] = {}
+        self.parsed_files: list[str] = []
+        for filename in filenames:
+            try:
+                with open(filename, encoding='utf-8') as file_handle:
+                    lines = file_handle.read().splitlines()
+            except OSError:
+                continue
+            self._read(filename, lines)
+            self.parsed_files.append(filename)
+
+    def _read(self, filename: str, lines: list):
+        """ parses the lines of one config file into self._sections """
+        section_name = None
+        option = None
+        for line_number, line in enumerate(lines, start=1):
+            stripped = line.strip()
+            if not stripped:
+                option = None
+                continue
+            if stripped.startswith((';', '#')):
+                continue
+            if line[0].isspace() and section_name is not None and option is not None:
+                # continuation of the previous value, like configparser
+                self._sections[section_name][option] += f"\n{stripped}"
+                continue
+            option = None
+            if stripped.startswith('['):
+                match = self._SECTION_RE.match(stripped)
+                if not match:
+                    raise ValueError(f"{filename}:{line_number}: invalid section header {line!r}")
+                section_name = match.group(1)
+                self._sections.setdefault(section_name, {})
+                continue
+            match = self._ENTRY_RE.match(stripped)
+            if not match:
+                raise ValueError(f"{filename}:{line_number}: can't parse {line!r}")
+            if section_name is None:
+                raise ValueError(f"{filename}:{line_number}: {line!r} is not in a section")
+            option = match.group(1).lower()
+            self._sections[section_name][option] = match.group(2)
+
+    def has_section(self, section: str) -> bool:
+        """ returns True if the section was in any of the config files """
+        return section in self._sections
+
+    def items(self, section: str) -> list:
+        """ returns a list of (option, value) pairs for a section """
+        return list(self._sections[section].items())
+
+    def _fallback(self, section: str, option: str, fallback):
+        """ returns the fallback value, or raises KeyError if there isn't one """
+        if fallback is self._MISSING:
+            raise KeyError(f"{section}.{option}")
+        return fallback
+
+    def get(self, section: str, option: str, fallback=_MISSING):
+        """ returns the option as a string, or fallback if it's not set """
+        value = self._sections.get(section, {}).get(option.lower())
+        if value is None:
+            return self._fallback(section, option, fallback)
+        return value
+
+    def getint(self, section: str, option: str, fallback=_MISSING):
+        """ returns the option as an int, or fallback if it's not set """
+        value = self._sections.get(section, {}).get(option.lower())
+        if value is None:
+            return self._fallback(section, option, fallback)
+        return int(value)
+
+    def getboolean(self, section: str, option: str, fallback=_MISSING):
+        """ returns the option as a bool, or fallback if it's not set """
+        value = self._sections.get(section, {}).get(option.lower())
+        if value is None:
+            return self._fallback(section, option, fallback)
+        if value.lower() not in self._BOOLEAN_STATES:
+            raise ValueError(f"{section}.{option} is not a boolean: {value!r}")
+        return self._BOOLEAN_STATES[value.lower()]
+
+
 class GPIOSwitch(): #pylint: disable=too-many-instance-attributes
     """ a single pin controller """
+
+    __slots__ = (
+        'name',
+        'device_class',
+        'client',
+        'mqtt_qos',
+        'logger',
+        'mock_pins',
+        'pin',
+        'pin_io',
+        'state',
+        '_config_topic',
+        '_state_topic',
+        '_command_topic',
+        '_config_payload',
+    )
+
+    # there's only two possible state payloads, indexed by the bool state (OFF, ON).
+    # single bytes keep every state message as small as possible, paho sends bytes as-is
+    _STATE_PAYLOADS = (b'0', b'1')
+
     def __init__(self, name: str,
                  pin: int,
                  client: mqtt.Client,
@@ -18,42 +146,55 @@ class GPIOSwitch(): #pylint: disable=too-many-instance-attributes
                 ): #pylint: disable=too-many-arguments
         self.name = name
         self.device_class = 'switch'
+        # topics and the config payload never change, so build them once
+        self._config_topic = f"homeassistant/{self.device_class}/{self.name}/config"
+        self._state_topic = f"{self.name}/state"
+        self._command_topic = f"{self.name}/cmnd"
+        self._config_payload = json.dumps({
+            'name' : self.name,
+            'state_topic' : self._state_topic,
+            'command_topic' : self._command_topic,
+            'payload_on' : '1',
+            'payload_off' : '0',
+            'state_on' : '1',
+            'state_off' : '0',
+        }, separators=(',', ':')).encode('utf-8')
         self.client = client
         self.mqtt_qos = qos
         self.logger = logging_object
         self.mock_pins = mock_pins
+        self.pin = int(pin)
         if mock_pins:
-            self.pin_io = gpiozero.Device.pin_factory.pin(pin)
+            self.pin_io = gpiozero.Device.pin_factory.pin(self.pin)
         else:
-            self.pin_io = gpiozero.LED(pin) # pylint: disable=undefined-variable
+            self.pin_io = gpiozero.LED(self.pin) # pylint: disable=undefined-variable
 
-        # might as well say hello on startup
-        self.announce_config()
-        self._set_state(initial_state)
+        # unknown until the first _set_state, so it always drives the pin
+        self.state = None
 
-    def str_state(self):
-        """ returns the state in the home assistant version """
-        if self.state:
-            return "ON"
-        return "OFF"
+        # the config is announced by the MQTT client's on_connect, once it's connected
+        self._set_state(initial_state)
 
     def config_topic(self):
         """ returns the config topic """
-        return f"homeassistant/{self.device_class}/{self.name}/config"
+        return self._config_topic
 
     def state_topic(self):
         """ returns the state topic as a string """
-        return f"{self.name}/state"
+        return self._state_topic
 
     def command_topic(self):
         """ returns the command topic as a string """
-        return f"{self.name}/cmnd"
+        return self._command_topic
 
-    def _publish(self, topic, payload):
-        """ publishes a message """
+    def _publish(self, topic, payload, qos=None, retain=False):
+        """ publishes a message, at the configured QoS unless qos is set """
+        if qos is None:
+            qos = self.mqtt_qos
         return self.client.publish(topic,
                                    payload,
-                                   qos=self.mqtt_qos,
+                                   qos=qos,
+                                   retain=retain,
                                    )
 
 
@@ -61,28 +202,19 @@ class GPIOSwitch(): #pylint: disable=too-many-instance-attributes
         """ sends the MQTT message to configure
             home assistant
         """
-        payload = {
-            'name' : self.name,
-            'state_topic' : self.state_topic(),
-            'command_topic' : self.command_topic(),
-            "val_tpl" : '{{value_json.POWER}}',
-        }
-        self.logger.debug(
-            "%s.announce_config(%s)",
-            self.name,
-            payload,
-            )
-        self._publish(
-            self.config_topic(),
-            payload=json.dumps(payload),
-            )
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("%s.announce_config(%s)", self.name, self._config_payload)
+        # retained, so the broker hands it to home assistant whenever it subscribes
+        self._publish(self._config_topic, payload=self._config_payload, retain=True)
 
     def announce_state(self):
         """ sends the MQTT message about the current state """
-        payload = {'POWER' : self.str_state()}
-
-        self.logger.debug("%s.announce_state(%s)", self.name, payload)
-        self._publish(self.state_topic(), payload=json.dumps(payload))
+        payload = self._STATE_PAYLOADS[self.state]
+        if self.logger.isEnabledFor(logging.DEBUG):
+            self.logger.debug("%s.announce_state(%s)", self.name, payload)
+        # state is re-sent on every change and reconnect, so losing one is harmless.
+        # retained, so new subscribers get the current state from the broker
+        self._publish(self._state_topic, payload=payload, qos=0, retain=True)
 
     def _set_state(self, state):
         """ Does a few things:
@@ -90,27 +222,29 @@ class GPIOSwitch(): #pylint: disable=too-many-instance-attributes
             - sets the GPIO
             - announces via MQTT the current state
         """
+        if self.state == state:
+            # nothing to change, and the broker already holds the retained state
+            return
         if self.mock_pins:
             if state:
                 self.pin_io.drive_low()
             else:
                 self.pin_io.drive_high()
-            self.logger.debug("%s:%s (dev-mode) = %s", self.name, self.pin_io, state)
+            self.logger.debug("%s:%s (dev-mode) = %s", self.name, self.pin, state)
         else:
             if state:
                 self.pin_io.on()
             else:
                 self.pin_io.off()
-            self.logger.debug("%s:%s (GPIO) = %s", self.name, self.pin_io, state)
+            self.logger.debug("%s:%s (GPIO) = %s", self.name, self.pin, state)
         self.state = state
         self.announce_state()
 
     def handle_command(self, payload):
         """ takes actions based on incoming commands """
         self.logger.debug("%s.handle_command(%s)", self.name, payload)
-        if payload == b'ON':
-            self._set_state(True)
-        elif payload == b'OFF':
-            self._set_state(False)
-        else:
-            self.logger.WARN("%s.handle_command(%s) is weird - should match '(ON|OFF)'", self.name, payload) # pylint: disable=line-too-long
+        new_state = COMMANDS.get(payload)
+        if new_state is None:
+            self.logger.warning("%s.handle_command(%s) is weird - should match '(ON|OFF|1|0)'", self.name, payload) # pylint: disable=line-too-long
+            return
+        self._set_state(new_state)
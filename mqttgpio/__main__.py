@@ -8,20 +8,23 @@ Discovery docs: https://www.home-assistant.io/docs/mqtt/discovery/
 Switch docs: https://developers.home-assistant.io/docs/en/entity_switch.html
 
 """
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import logging
-from os import uname
+import os
+import platform
+import random
+import socket
 import time
 import sys
-import configparser
 
 try:
     import gpiozero # type: ignore
     import paho.mqtt.client as mqtt # type: ignore
-    import schedule # type: ignore
 except ImportError as import_error:
     sys.exit(f"Package import failure: {import_error}")
 
-from . import GPIOSwitch
+from . import FastConfigParser, GPIOSwitch
 
 
 LOG_OBJECT = logging.getLogger('mqttcontroller') #pylint: disable: invalid-name
@@ -29,9 +32,9 @@ LOG_OBJECT.addHandler(logging.StreamHandler())
 
 
 
-CONFIG = configparser.ConfigParser()
 CONFIGFILES = ['/etc/mqttgpio.conf', './mqttgpio.conf', '/opt/mqttgpio/mqttgpio.conf']
-PARSED_FILES = CONFIG.read(CONFIGFILES)
+CONFIG = FastConfigParser(CONFIGFILES)
+PARSED_FILES = CONFIG.parsed_files
 
 LOG_LEVEL = CONFIG.get('Default', 'logging', fallback='info')
 
@@ -48,106 +51,166 @@ else:
 
 LOG_OBJECT.info("Loaded configuration from: %s", ','.join(PARSED_FILES))
 
+MQTT_QOS = CONFIG.getint("MQTT", 'MQTTQOS', fallback=1)
+MQTT_BROKER = CONFIG.get("MQTT", "MQTTBroker", fallback='localhost')
+MQTT_PORT = CONFIG.getint("MQTT", "MQTTPort", fallback=1883)
 
+# anything that isn't a Pi gets mock pins
+PI_MACHINES = {'armv6l', 'armv7l', 'armv8l', 'aarch64', 'arm64'}
+MOCK_PINS = platform.machine() not in PI_MACHINES
 
-def mqtt_on_connect(client_object, userdata, flags, result_code): # noqa: pylint: disable=unused-argument
+# filled in from the config when running as __main__, read by the MQTT callbacks
+ACTIVE_DEVICES: list = []
+COMMAND_TOPIC_MAP: dict = {}
+
+# a single worker, so commands for a device are applied in the order they arrived.
+# the thread is only started when the first command is submitted
+EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix='mqttgpio-command')
+
+def mqtt_on_connect(client_object, userdata, flags, reason_code, properties): # noqa: pylint: disable=unused-argument,too-many-arguments
     """The callback for when the client receives a CONNACK response from the server."""
-    LOG_OBJECT.info("Connected with result code %s", result_code)
+    if reason_code.is_failure:
+        # paho calls on_connect for refused CONNACKs too, there's no session to use
+        record_connect_failure(userdata, f"refused: {reason_code}")
+        return
+    LOG_OBJECT.info("Connected with result code %s", reason_code)
+    userdata['connect_failures'] = 0
+
+    # announcements are small and latency sensitive, so don't let Nagle hold them back
+    client_object.socket().setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
     # Subscribing in on_connect() means that if we lose the connection and
-    # reconnect then subscriptions will be renewed.
-    client_object.subscribe("$SYS/#")
+    # reconnect then subscriptions will be renewed. A reconnect that kept our session
+    # can skip it, but always subscribe on the first connect of the process - the
+    # session may be from a previous run with a different set of devices.
+    # one SUBSCRIBE packet for everything, rather than one round trip per device.
+    # QoS 0, so the broker doesn't queue up commands while we're offline and replay
+    # them over the *_default states when we come back.
+    if COMMAND_TOPIC_MAP and not (flags.session_present and userdata['subscribed']):
+        result, _ = client_object.subscribe([(command_topic, 0) for command_topic in COMMAND_TOPIC_MAP])
+        userdata['subscribed'] = result == mqtt.MQTT_ERR_SUCCESS
     for device_object in ACTIVE_DEVICES:
-        client_object.subscribe(device_object.command_topic())
+        # anything published before we (re)connected might not have made it out
+        device_object.announce_config()
+        device_object.announce_state()
+
+def mqtt_on_connect_fail(client_object, userdata): # noqa: pylint: disable=unused-argument
+    """The callback for when paho's network loop fails to (re)connect, it'll retry with backoff."""
+    record_connect_failure(userdata, "unable to connect")
+
+def record_connect_failure(userdata, reason):
+    """ counts and logs a failed connection attempt, socket errors and refused CONNACKs alike.
+        both run on paho's network thread just before it backs off and retries
+    """
+    userdata['connect_failures'] += 1
+    LOG_OBJECT.warning("mqtt://%s:%s %s (attempt %s), retrying",
+                       MQTT_BROKER,
+                       MQTT_PORT,
+                       reason,
+                       userdata['connect_failures'],
+                       )
+    # paho's backoff is identical for every client, so add up to a second of jitter to
+    # each attempt - this stops a fleet that rebooted together retrying in lockstep
+    time.sleep(random.uniform(0, 1))
+
+def mqtt_on_device_message(device_object, client_object, userdata, msg): # noqa: pylint: disable=unused-argument
+    """The callback paho calls directly for a PUBLISH to device_object's command topic."""
+    LOG_OBJECT.info("Command to %s : %s", device_object.name, msg.payload)
+    # the GPIO write and state publish happen off the network thread
+    EXECUTOR.submit(run_command, device_object, msg.payload)
 
 def mqtt_on_message(client_object, userdata, msg): # noqa: pylint: disable=unused-argument
-    """The callback for when a PUBLISH message is received from the server."""
-    matched = False
-    for device_object in ACTIVE_DEVICES:
-        if msg.topic == device_object.command_topic():
-            LOG_OBJECT.info("Command to %s : %s", device_object.name, msg.payload)
-            device_object.handle_command(msg.payload)
-            matched = True
-    if not matched and not msg.topic.startswith('$SYS'):
-        LOG_OBJECT.info("Command for unknown device: %s=%s", msg.topic, msg.payload)
+    """The callback for a PUBLISH that didn't match any device's command topic."""
+    LOG_OBJECT.info("Command for unknown device: %s=%s", msg.topic, msg.payload)
+
+def run_command(device_object, payload):
+    """ runs a device command on the EXECUTOR thread, logging any failure """
+    try:
+        device_object.handle_command(payload)
+    except Exception as error_message: # pylint: disable=broad-exception-caught
+        LOG_OBJECT.error("%s failed to handle %s: %s", device_object.name, payload, error_message)
+
+def make_switch(client, name, pin, initial_state):
+    """ creates the GPIOSwitch for a configured device, publishing through client """
+    LOG_OBJECT.debug("Creating %s:%s (%s)", name, pin, initial_state)
+    return GPIOSwitch(name=name,
+                      pin=pin,
+                      client=client,
+                      qos=MQTT_QOS,
+                      initial_state=initial_state,
+                      mock_pins=MOCK_PINS,
+                      logging_object=LOG_OBJECT,
+                      )
 
 if __name__ == '__main__':
 
-    MQTT_QOS = CONFIG.getint("MQTT", 'MQTTQOS', fallback=2)
-    MQTT_BROKER = CONFIG.get("MQTT", "MQTTBroker", fallback='localhost')
-    MQTT_PORT = CONFIG.getint("MQTT", "MQTTPort", fallback=1883)
-
-    MQTTCLIENT = mqtt.Client()
+    # read and validate the devices before touching MQTT or any GPIO pins
+    DEVICE_PINS = {}
+    DEVICE_DEFAULTS = {}
+    if CONFIG.has_section('Devices'):
+        try:
+            # split the section into pins and their <name>_default states in one pass
+            for device_name, device_value in CONFIG.items('Devices'):
+                if device_name.endswith("_default"):
+                    DEVICE_DEFAULTS[device_name[:-len("_default")]] = CONFIG.getboolean('Devices', device_name)
+                else:
+                    DEVICE_PINS[device_name] = int(device_value)
+        except ValueError as error:
+            LOG_OBJECT.error(
+                "ValueError handling the configured devices, bailing: %s",
+                error,
+                )
+            sys.exit(1)
+
+    # a stable client id and a persistent session let the broker keep our subscriptions
+    # across reconnects. clean_session only applies to MQTT 3.1.1, so stay on that.
+    # userdata is shared with the callbacks above
+    MQTTCLIENT = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2,
+                             client_id=f"{socket.gethostname()}-mqttgpio",
+                             clean_session=False,
+                             protocol=mqtt.MQTTv311,
+                             userdata={'connect_failures': 0, 'subscribed': False},
+                             )
     # callback functions for MQTT
     MQTTCLIENT.on_connect = mqtt_on_connect
+    MQTTCLIENT.on_connect_fail = mqtt_on_connect_fail
     MQTTCLIENT.on_message = mqtt_on_message
+    # paho's network loop handles (re)connecting, doubling the delay up to 60 seconds
+    MQTTCLIENT.reconnect_delay_set(min_delay=1, max_delay=60)
 
 
-    LOG_OBJECT.debug("Connecting to mqtt://%s:%s", MQTT_BROKER, MQTT_PORT)
-    while True:
-        try:
-            MQTTCLIENT.connect(MQTT_BROKER, MQTT_PORT, 60)
-            break # break out of the "retry until it works" loop
-        except ConnectionRefusedError:
-            LOG_OBJECT.info("Unable to connect to mqtt://%s:%s, connection refused. Sleeping for 60 seconds.", # pylint: disable=line-too-long
-                            MQTT_BROKER,
-                            MQTT_PORT,
-                            )
-            time.sleep(60)
-    LOG_OBJECT.debug("Connected to mqtt://%s:%s", MQTT_BROKER, MQTT_PORT)
-
-
-    if 'arm' in uname().machine:
-        MOCK_PINS = False
-    else:
+    if MOCK_PINS:
         from gpiozero.pins.mock import MockFactory # type: ignore
         gpiozero.Device.pin_factory = MockFactory()
-        MOCK_PINS = True
         LOG_OBJECT.info("Not running on a Pi, using mock objects")
 
 
     # create the device/pin associations from the config file
-    ACTIVE_DEVICES = []
-    if CONFIG.has_section('Devices'):
-        for device_name, device_pin in CONFIG.items('Devices'):
-            if not device_name.endswith("_default"):
-                # look for a device_state option
-                config_state = CONFIG.getboolean('Devices',
-                                                 f"{device_name}_default",
-                                                 fallback=False,
-                                                )
-                LOG_OBJECT.debug("Creating %s:%s (%s)", device_name, device_pin, config_state)
-                try:
-                    int_device_pin = int(device_pin)
-                except ValueError as error:
-                    LOG_OBJECT.error(
-                        "ValueError handling the configured device pin, bailing: %s",
-                        error,
-                        )
-                    sys.exit(1)
-                ACTIVE_DEVICES.append(GPIOSwitch(name=device_name,
-                                                 pin=int(device_pin),
-                                                 client=MQTTCLIENT,
-                                                 qos=MQTT_QOS,
-                                                 initial_state=config_state,
-                                                 mock_pins=MOCK_PINS,
-                                                 logging_object=LOG_OBJECT,
-                                                 ))
-
-    LOG_OBJECT.debug("Starting the MQTT thread")
-    MQTTCLIENT.loop_start()
-
-    LOG_OBJECT.debug("Scheduling regular events... ")
-    for device in ACTIVE_DEVICES:
-        schedule.every(5).minutes.do(device.announce_config)
-        schedule.every(30).seconds.do(device.announce_state)
-    LOG_OBJECT.debug("Scheduling complete.")
+    ACTIVE_DEVICES = [make_switch(MQTTCLIENT,
+                                  device_name,
+                                  device_pin,
+                                  DEVICE_DEFAULTS.get(device_name, False),
+                                  )
+                      for device_name, device_pin in DEVICE_PINS.items()]
+    # command topic -> device, paho dispatches each topic straight to its device
+    COMMAND_TOPIC_MAP = {device.command_topic(): device for device in ACTIVE_DEVICES}
+    for device_topic, topic_device in COMMAND_TOPIC_MAP.items():
+        MQTTCLIENT.message_callback_add(device_topic, partial(mqtt_on_device_message, topic_device))
 
+    LOG_OBJECT.debug("Connecting to mqtt://%s:%s", MQTT_BROKER, MQTT_PORT)
+    MQTTCLIENT.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+    # pin the main thread, which runs the network loop, to the highest CPU it's allowed on
+    # so the receive buffers stay in that core's cache. threads it spawns later, like the
+    # command worker, inherit the mask. the highest CPU is used because CPU0 takes most of
+    # the interrupts on a Pi. a no-op on single core boards like the Pi Zero
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {max(os.sched_getaffinity(0))})
     LOG_OBJECT.info("Starting the main loop")
+    # config and state are retained and state is published on every change, so there's
+    # nothing to do between messages - let paho's network loop run on the main thread
     while True:
         try:
-            schedule.run_pending()
-            time.sleep(1)
+            MQTTCLIENT.loop_forever(retry_first_connection=True)
         # a hail-mary to keep it running :)
         # pylint: disable=broad-except
         except Exception as error_message:
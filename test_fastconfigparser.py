@@ -0,0 +1,98 @@
+""" tests for mqttgpio.FastConfigParser """
+
+import pytest
+
+from mqttgpio import FastConfigParser
+
+
+def write_config(tmp_path, contents: str, filename: str = "mqttgpio.conf") -> str:
+    """ writes a config file and returns its path """
+    config_file = tmp_path / filename
+    config_file.write_text(contents, encoding="utf-8")
+    return str(config_file)
+
+
+def test_sections_and_items(tmp_path):
+    """ sections are read, option names lower-cased, comments and blanks skipped """
+    config = FastConfigParser([write_config(tmp_path, """
+# a comment
+[MQTT]
+MQTTBroker = mqtt.example.com
+; another comment
+MQTTPort: 1884
+
+[My Devices]
+powerpi_1 = 13
+""")])
+    assert config.has_section("MQTT")
+    assert config.has_section("My Devices")
+    assert not config.has_section("Devices")
+    assert config.get("MQTT", "MQTTBroker") == "mqtt.example.com"
+    assert config.get("MQTT", "mqttbroker") == "mqtt.example.com"
+    assert config.getint("MQTT", "MQTTPort") == 1884
+    assert config.items("My Devices") == [("powerpi_1", "13")]
+
+
+def test_later_files_override(tmp_path):
+    """ missing files are skipped and later files override earlier ones """
+    first = write_config(tmp_path, "[MQTT]\nMQTTPort = 1883\nMQTTQOS = 2\n", "first.conf")
+    second = write_config(tmp_path, "[MQTT]\nMQTTPort = 1884\n", "second.conf")
+    missing = str(tmp_path / "missing.conf")
+    config = FastConfigParser([first, missing, second])
+    assert config.parsed_files == [first, second]
+    assert config.getint("MQTT", "MQTTPort") == 1884
+    assert config.getint("MQTT", "MQTTQOS") == 2
+
+
+def test_indented_lines(tmp_path):
+    """ indented lines continue the previous value, or are keys at the start of a section """
+    config = FastConfigParser([write_config(tmp_path, "[Default]\n  first = 1\nsecond = a\n  b\n")])
+    assert config.get("Default", "first") == "1"
+    assert config.get("Default", "second") == "a\nb"
+
+
+def test_fallback(tmp_path):
+    """ fallback is returned for missing options and sections, KeyError without one """
+    config = FastConfigParser([write_config(tmp_path, "[MQTT]\nMQTTPort = 1884\n")])
+    assert config.get("MQTT", "MQTTBroker", fallback="localhost") == "localhost"
+    assert config.get("Default", "logging", fallback="info") == "info"
+    assert config.getint("MQTT", "MQTTQOS", fallback=1) == 1
+    assert config.getboolean("Devices", "powerpi_1_default", fallback=False) is False
+    with pytest.raises(KeyError):
+        config.get("MQTT", "MQTTBroker")
+
+
+def test_getint(tmp_path):
+    """ getint converts the value, and raises ValueError on junk """
+    config = FastConfigParser([write_config(tmp_path, "[MQTT]\nMQTTPort = 1884\nMQTTQOS = two\n")])
+    assert config.getint("MQTT", "MQTTPort", fallback=1883) == 1884
+    with pytest.raises(ValueError):
+        config.getint("MQTT", "MQTTQOS", fallback=1)
+
+
+@pytest.mark.parametrize("value,expected", [
+    ("1", True), ("yes", True), ("True", True), ("on", True),
+    ("0", False), ("no", False), ("FALSE", False), ("off", False),
+])
+def test_getboolean(tmp_path, value, expected):
+    """ getboolean accepts the same values as configparser """
+    config = FastConfigParser([write_config(tmp_path, f"[Devices]\npowerpi_1_default = {value}\n")])
+    assert config.getboolean("Devices", "powerpi_1_default", fallback=False) is expected
+
+
+def test_getboolean_invalid(tmp_path):
+    """ getboolean raises ValueError rather than guessing """
+    config = FastConfigParser([write_config(tmp_path, "[Devices]\npowerpi_1_default = maybe\n")])
+    with pytest.raises(ValueError):
+        config.getboolean("Devices", "powerpi_1_default", fallback=False)
+
+
+@pytest.mark.parametrize("contents", [
+    "[MQTT]\nMQTTBroker\n",
+    "[MQTT]\n[]\nx = 1\n",
+    "MQTTPort = 1883\n",
+])
+def test_invalid_lines(tmp_path, contents):
+    """ lines that aren't a header, entry, comment or blank raise ValueError """
+    with pytest.raises(ValueError):
+        FastConfigParser([write_config(tmp_path, contents)])
@@ -0,0 +1,132 @@
+""" tests for mqttgpio.GPIOSwitch """
+
+import json
+import logging
+from typing import cast
+
+import gpiozero # type: ignore
+from gpiozero.pins.mock import MockFactory # type: ignore
+import paho.mqtt.client as mqtt # type: ignore
+import pytest
+
+from mqttgpio import GPIOSwitch
+
+
+class StubClient(): # pylint: disable=too-few-public-methods
+    """ records publish calls instead of sending them """
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        """ stores the message """
+        self.published.append((topic, payload, qos, retain))
+
+
+@pytest.fixture(name="mock_factory", autouse=True)
+def fixture_mock_factory():
+    """ uses gpiozero's mock pins for every test """
+    old_factory = gpiozero.Device.pin_factory
+    gpiozero.Device.pin_factory = MockFactory()
+    yield gpiozero.Device.pin_factory
+    gpiozero.Device.pin_factory = old_factory
+
+
+def make_switch(initial_state: bool = False, qos: int = 1):
+    """ returns a mock pinned switch on pin 13, and its client with the initial state cleared """
+    client = StubClient()
+    switch = GPIOSwitch(name="powerpi_1",
+                        pin=13,
+                        client=cast(mqtt.Client, client),
+                        qos=qos,
+                        logging_object=logging.getLogger("test_gpioswitch"),
+                        initial_state=initial_state,
+                        mock_pins=True,
+                        )
+    client.published.clear()
+    return switch, client
+
+
+def test_init_sets_state():
+    """ the initial state drives the pin and is announced, the config isn't """
+    client = StubClient()
+    switch = GPIOSwitch("powerpi_1", 13, cast(mqtt.Client, client), 1, logging.getLogger("test_gpioswitch"),
+                        initial_state=True, mock_pins=True)
+    assert switch.state is True
+    assert switch.pin_io.state == 0
+    assert client.published == [("powerpi_1/state", b'1', 0, True)]
+
+
+@pytest.mark.parametrize("payload,expected", [
+    (b'ON', True), (b'on', True), (b'1', True),
+    (b'OFF', False), (b'off', False), (b'0', False),
+])
+def test_handle_command(payload, expected):
+    """ every command variant sets the state and publishes it """
+    switch, client = make_switch(initial_state=not expected)
+    switch.handle_command(payload)
+    assert switch.state is expected
+    assert client.published == [("powerpi_1/state", b'1' if expected else b'0', 0, True)]
+
+
+def test_mock_pin_driven(mock_factory):
+    """ ON drives the mock pin low and OFF drives it high """
+    switch, _ = make_switch()
+    pin = mock_factory.pin(13)
+    switch.handle_command(b'ON')
+    assert pin.state == 0
+    switch.handle_command(b'OFF')
+    assert pin.state == 1
+
+
+@pytest.mark.parametrize("payload", [b'', b'On', b'true', b'2', b'ON\n'])
+def test_handle_command_junk(payload, caplog):
+    """ anything else is ignored with a warning """
+    switch, client = make_switch()
+    with caplog.at_level(logging.WARNING):
+        switch.handle_command(payload)
+    assert switch.state is False
+    assert not client.published
+    assert "is weird" in caplog.text
+
+
+def test_handle_command_no_change():
+    """ a command for the current state doesn't publish again """
+    switch, client = make_switch(initial_state=True)
+    switch.handle_command(b'ON')
+    switch.handle_command(b'1')
+    assert switch.state is True
+    assert not client.published
+
+
+def test_announce_state():
+    """ state is a single byte, QoS 0 and retained """
+    switch, client = make_switch()
+    switch.announce_state()
+    switch.handle_command(b'ON')
+    switch.announce_state()
+    assert client.published == [
+        ("powerpi_1/state", b'0', 0, True),
+        ("powerpi_1/state", b'1', 0, True),
+        ("powerpi_1/state", b'1', 0, True),
+    ]
+
+
+@pytest.mark.parametrize("qos", [0, 1, 2])
+def test_announce_config(qos):
+    """ config is retained and sent at the configured QoS """
+    switch, client = make_switch(qos=qos)
+    switch.announce_config()
+    assert len(client.published) == 1
+    topic, payload, published_qos, retain = client.published[0]
+    assert topic == "homeassistant/switch/powerpi_1/config"
+    assert published_qos == qos
+    assert retain is True
+    assert json.loads(payload) == {
+        'name' : 'powerpi_1',
+        'state_topic' : 'powerpi_1/state',
+        'command_topic' : 'powerpi_1/cmnd',
+        'payload_on' : '1',
+        'payload_off' : '0',
+        'state_on' : '1',
+        'state_off' : '0',
+    }